@@ -3,7 +3,8 @@ SD Tennis Lessons — Video Analysis Pipeline
 Handles: video upload → frame extraction → Claude API → structured report
 
 Dependencies:
-    pip install anthropic opencv-python-headless Pillow requests
+    pip install anthropic pybase64 opencv-python-headless Pillow requests
+    pip install boto3  # used when sending frames by URL (FRAME_BUCKET)
 
 FFmpeg must be installed on the server:
     macOS: brew install ffmpeg
@@ -12,14 +13,21 @@ FFmpeg must be installed on the server:
 """
 
 import anthropic
-import base64
+import functools
 import json
 import os
+import pybase64
+import re
+import struct
 import subprocess
-import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
-from coaching_prompt import SYSTEM_PROMPT, build_user_prompt
+from typing import BinaryIO, Iterator, Optional, Union
+from coaching_prompt import (
+    SYSTEM_PROMPT, build_clip_header, build_multi_clip_prompt, build_stroke_prompt, build_user_prompt
+)
 
 
 # ─────────────────────────────────────────────────────────
@@ -33,89 +41,416 @@ FRAMES_TO_EXTRACT = 10
 # Max video duration to process (seconds) — keeps costs predictable
 MAX_VIDEO_DURATION = 120  # 2 minutes
 
+# Long edge (px) frames are downscaled to before sending to Claude
+# Claude bills images by pixel count (~w*h/750 tokens); 768px keeps enough
+# detail for stroke mechanics at a fraction of the full-resolution cost
+MAX_FRAME_EDGE = 768
+
 # Claude model to use — Opus gives the best coaching analysis
 CLAUDE_MODEL = "claude-opus-4-6"
 
+# Shortest prompt prefix the API will cache for CLAUDE_MODEL — 4096 tokens for
+# Opus 4.5 and later (1024 for Sonnet and earlier Opus). Shorter prefixes are
+# sent uncached; the cache_control markers are accepted but ignored
+MIN_CACHEABLE_TOKENS = 4096
+
+# Response budget per clip analyzed in a request
+MAX_TOKENS_PER_CLIP = 2048
+
+# Most clips batched into a single Claude request
+MAX_CLIPS_PER_BATCH = 4
+
+# Container families we accept, keyed by file extension — used to sniff
+# uploads before handing them to FFmpeg
+CONTAINER_FAMILIES = {
+    "mp4": "iso", "mov": "iso", "m4v": "iso",
+    "avi": "avi",
+    "mkv": "matroska", "webm": "matroska",
+}
+
+# Hardware decode for FFmpeg: "auto" lets FFmpeg pick whatever this host has
+# (VideoToolbox, NVDEC, QSV, VAAPI) and falls back to software decode when
+# none works for a file; a specific name forces that method; "none" disables
+FFMPEG_HWACCEL = os.environ.get("FFMPEG_HWACCEL", "auto")
+HWACCEL_ARGS = () if FFMPEG_HWACCEL == "none" else ("-hwaccel", FFMPEG_HWACCEL)
+
+# Send frames to Claude as URLs instead of inline base64: set FRAME_BUCKET to
+# an S3 (or R2, via FRAME_S3_ENDPOINT_URL) bucket. Frames are uploaded there
+# and Claude fetches them through short-lived presigned URLs — no base64
+# encode, and a ~33% smaller request body. Frames are deleted as soon as the
+# Claude call finishes (delete_frames). Deployment requirement: also give the
+# bucket a lifecycle rule expiring the frames/ prefix after a day, to catch
+# anything a crashed worker left behind — these are student videos.
+FRAME_BUCKET = os.environ.get("FRAME_BUCKET")
+FRAME_S3_ENDPOINT_URL = os.environ.get("FRAME_S3_ENDPOINT_URL")
+FRAME_URL_TTL = 900  # seconds — long enough for Claude to fetch them
+USE_FRAME_URLS = bool(FRAME_BUCKET)
+
+# Most FFmpeg decodes running at once per process — each one pegs a core, so
+# more than the core count just thrashes. Extra requests wait for a slot.
+# (Under gevent this semaphore is cooperative: waiting requests park their
+# green thread rather than blocking the worker.)
+FFMPEG_MAX_CONCURRENCY = int(os.environ.get("FFMPEG_MAX_CONCURRENCY", os.cpu_count() or 1))
+_FFMPEG_SLOTS = threading.BoundedSemaphore(FFMPEG_MAX_CONCURRENCY)
+
+# Frame image format sent to Claude — WebP is ~25-35% smaller than JPEG at
+# matched visual quality, which shrinks both base64 and upload payloads
+FRAME_MEDIA_TYPE = "image/webp"
+FRAME_EXTENSION = "webp"
+
 
 # ─────────────────────────────────────────────────────────
 # FRAME EXTRACTION
 # ─────────────────────────────────────────────────────────
 
-def extract_frames(video_path: str, num_frames: int = FRAMES_TO_EXTRACT) -> list[str]:
+def extract_frames(video_path: Union[str, Path], num_frames: int = FRAMES_TO_EXTRACT) -> list[str]:
     """
     Extracts evenly-spaced frames from a video using FFmpeg.
-    Returns list of base64-encoded JPEG strings.
+    Returns list of base64-encoded WebP strings.
     
     Why FFmpeg over OpenCV?
     - More reliable with diverse video formats (MOV, MP4, HEVC from iPhones)
     - Better handles variable frame rates from phone cameras
     - Faster for extraction-only tasks
     """
+    return [_encode_frame(frame) for frame in _extract_frames(video_path, num_frames)]
+
+
+def extract_frame_urls(
+    video_path: Union[str, Path],
+    num_frames: int = FRAMES_TO_EXTRACT
+) -> tuple[list[str], list[str]]:
+    """
+    Like extract_frames, but uploads the frames to FRAME_BUCKET instead of
+    base64-encoding them. Returns (keys, presigned URLs) in frame order;
+    pass the keys to delete_frames once Claude has fetched the frames.
+    """
+    return _upload_frames(_extract_frames(video_path, num_frames))
+
+
+def _extract_frames(video_path: Union[str, Path], num_frames: int) -> list[memoryview]:
+    """
+    Checks the video, runs FFmpeg over it and returns the sampled frames as
+    raw WebP images.
+    """
     video_path = Path(video_path)
     if not video_path.exists():
         raise FileNotFoundError(f"Video not found: {video_path}")
 
+    # Reject unsupported or mislabelled files before spending any FFmpeg time
+    with open(video_path, "rb") as f:
+        _sniff_container(f.read(32), video_path.name)
+
     # Get video duration first
     duration = get_video_duration(str(video_path))
     if duration > MAX_VIDEO_DURATION:
         print(f"Warning: Video is {duration:.0f}s. Analyzing first {MAX_VIDEO_DURATION}s only.")
         duration = MAX_VIDEO_DURATION
 
-    # Calculate frame extraction interval
+    # Calculate frame extraction interval and sample from the middle of each
+    # slot, so the first/last frames don't land on a black fade in or out
     interval = duration / num_frames
+    timestamps = [interval * (i + 0.5) for i in range(num_frames)]
+
+    # Seek straight to the first sample; timestamps inside the filter are then
+    # relative to that point
+    seek_start = timestamps[0]
+    select_filter = _build_select_filter([t - seek_start for t in timestamps])
+    scale_filter = _build_scale_filter(MAX_FRAME_EDGE)
+
+    # Extract frames at the target timestamps, streamed as WebP images on stdout
+    # -ss before -i = input seek, skips decoding everything before the first sample
+    # -vf select = keep only the frames nearest each timestamp
+    # -vf scale = clamp the long edge to MAX_FRAME_EDGE, keeping aspect ratio
+    # -vsync vfr = emit only the selected frames, no duplicates to fill gaps
+    # -c:v libwebp -q:v 75 = lossy WebP at quality 75 (0-100) — Claude
+    #   downsamples internally, so anything sharper is just upload bandwidth
+    # -pix_fmt yuv420p = 4:2:0 chroma subsampling, the format lossy WebP stores
+    # -vframes {num_frames} = stop after N frames
+    # -f image2pipe pipe:1 = write frames back-to-back to stdout, no temp files
+    # -hwaccel = decode on fixed-function hardware when available
+    cmd = [
+        "ffmpeg",
+        *HWACCEL_ARGS,
+        "-ss", f"{seek_start:.3f}",
+        "-i", str(video_path),
+        "-vf", f"{select_filter},{scale_filter}",
+        "-vsync", "vfr",
+        "-c:v", "libwebp",
+        "-q:v", "75",
+        "-pix_fmt", "yuv420p",
+        "-vframes", str(num_frames),
+        "-f", "image2pipe",
+        "pipe:1"
+    ]
 
-    frames_b64 = []
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Extract frames at calculated intervals
-        # -vf fps=1/{interval} = extract one frame every N seconds
-        # -q:v 2 = high quality JPEG (1=best, 31=worst)
-        # -vframes {num_frames} = stop after N frames
-        cmd = [
-            "ffmpeg",
-            "-i", str(video_path),
-            "-vf", f"fps=1/{interval:.2f}",
-            "-q:v", "2",
-            "-vframes", str(num_frames),
-            "-y",  # overwrite without asking
-            f"{tmpdir}/frame_%03d.jpg"
-        ]
+    data = _run_ffmpeg(cmd)
+
+    # Split the piped stream into individual images, kept in memory
+    frames = _split_webp_stream(data)
+
+    if not frames:
+        raise RuntimeError("No frames were extracted. Check video format.")
+
+    print(f"Extracted {len(frames)} frames from {video_path.name}")
+    return frames
+
+
+@functools.lru_cache(maxsize=1)
+def _s3_client():
+    """Creates the S3 client for FRAME_BUCKET once per process."""
+    import boto3
+    return boto3.client("s3", endpoint_url=FRAME_S3_ENDPOINT_URL)
+
+
+def _upload_frames(frames: list[memoryview]) -> tuple[list[str], list[str]]:
+    """
+    Uploads WebP frames to FRAME_BUCKET in parallel and returns their keys
+    and presigned GET URLs, in frame order. If any upload fails, the frames
+    already uploaded are deleted and RuntimeError is raised.
+    """
+    if not FRAME_BUCKET:
+        raise RuntimeError("FRAME_BUCKET is not set — cannot send frames by URL")
+
+    s3 = _s3_client()
+    prefix = f"frames/{uuid.uuid4().hex}"
+    keys = [f"{prefix}/{i + 1:03d}.{FRAME_EXTENSION}" for i in range(len(frames))]
+
+    def upload(key_frame: tuple[str, memoryview]) -> str:
+        key, frame = key_frame
+        s3.put_object(Bucket=FRAME_BUCKET, Key=key, Body=bytes(frame), ContentType=FRAME_MEDIA_TYPE)
+        return s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": FRAME_BUCKET, "Key": key},
+            ExpiresIn=FRAME_URL_TTL
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(frames)) as pool:
+            urls = list(pool.map(upload, zip(keys, frames)))
+    except Exception as e:
+        # The pool has finished every upload by now — don't leave part of a
+        # student's video behind in the bucket
+        delete_frames(keys)
+        raise RuntimeError(f"Could not upload frames to {FRAME_BUCKET}: {e}") from e
 
-        result = subprocess.run(
+    return keys, urls
+
+
+def delete_frames(frame_keys: list[str]) -> None:
+    """
+    Deletes frames uploaded by _upload_frames, given their keys.
+    Called once Claude has fetched them; failures are logged, not raised,
+    since the bucket lifecycle rule will still expire them.
+    """
+    if not frame_keys:
+        return
+
+    try:
+        result = _s3_client().delete_objects(
+            Bucket=FRAME_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in frame_keys], "Quiet": True}
+        )
+    except Exception as e:
+        print(f"Warning: could not delete {len(frame_keys)} frames from {FRAME_BUCKET}: {e}")
+        return
+
+    # Quiet mode only reports the keys that failed
+    for error in result.get("Errors", []):
+        print(f"Warning: could not delete {error.get('Key')} from {FRAME_BUCKET}: {error.get('Message')}")
+
+
+def _run_ffmpeg(cmd: list[str]) -> bytes:
+    """
+    Runs an FFmpeg command and returns its stdout.
+    At most FFMPEG_MAX_CONCURRENCY run at once.
+    """
+    # Wait for a free FFmpeg slot so concurrent uploads queue instead of
+    # oversubscribing the CPU
+    with _FFMPEG_SLOTS:
+        proc = subprocess.Popen(
             cmd,
-            capture_output=True,
-            text=True,
-            timeout=60
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
         )
+        try:
+            data, err = proc.communicate(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise RuntimeError("FFmpeg timed out while extracting frames")
 
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg failed: {result.stderr}")
+    if proc.returncode != 0:
+        raise RuntimeError(f"FFmpeg failed: {err.decode('utf-8', errors='replace')}")
+    return data
 
-        # Load and encode frames
-        frame_files = sorted(Path(tmpdir).glob("frame_*.jpg"))
 
-        if not frame_files:
-            raise RuntimeError("No frames were extracted. Check video format.")
+def _sniff_container(header: bytes, filename: str) -> str:
+    """
+    Identifies the container from its first 32 header bytes and checks it
+    matches the file extension. Returns the container family ("iso", "avi",
+    "matroska"); raises RuntimeError for anything else.
+    """
+    if header[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"):
+        family = "iso"
+    elif header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        family = "avi"
+    elif header[:4] == b"\x1aE\xdf\xa3":
+        family = "matroska"
+    else:
+        raise RuntimeError("Unsupported container")
+
+    suffix = Path(filename).suffix
+    expected = CONTAINER_FAMILIES.get(suffix.lower().lstrip("."))
+    if expected and expected != family:
+        raise RuntimeError(
+            f"Unsupported container: {suffix} file contains {family} data"
+        )
+    return family
 
-        for frame_path in frame_files:
-            with open(frame_path, "rb") as f:
-                frame_data = base64.standard_b64encode(f.read()).decode("utf-8")
-                frames_b64.append(frame_data)
 
-    print(f"Extracted {len(frames_b64)} frames from {video_path.name}")
-    return frames_b64
+def _build_select_filter(timestamps: list[float]) -> str:
+    """
+    Builds an FFmpeg select filter that keeps exactly one frame per timestamp:
+    the first decoded frame at or after it.
+    """
+    terms = [
+        f"gte(t\\,{ts:.3f})*(isnan(prev_selected_t)+lt(prev_selected_t\\,{ts:.3f}))"
+        for ts in timestamps
+    ]
+    return f"select='{'+'.join(terms)}'"
+
+
+def _encode_frame(frame: Union[bytes, memoryview]) -> str:
+    """
+    Base64-encodes a single WebP frame for the Claude image block.
+    pybase64 dispatches to SIMD (AVX2/AVX-512/NEON) at runtime — several
+    times faster than the stdlib encoder on multi-hundred-KB frames.
+    """
+    return pybase64.b64encode(frame).decode("ascii")
+
+
+def _build_scale_filter(max_edge: int) -> str:
+    """
+    Builds an FFmpeg scale filter that clamps the long edge to max_edge,
+    preserving aspect ratio (even dimensions) and never upscaling.
+    """
+    return (
+        f"scale='if(gt(iw,ih),min({max_edge},iw),-2)'"
+        f":'if(gt(iw,ih),-2,min({max_edge},ih))'"
+    )
+
+
+def _split_webp_stream(data: bytes) -> list[memoryview]:
+    """
+    Splits concatenated WebP output from image2pipe into individual frames.
+    Each frame is a RIFF container: "RIFF", a little-endian u32 payload size,
+    then the payload (padded to an even length), so frames are walked by size.
+    Frames are zero-copy views into `data`; pybase64 encodes them directly.
+    """
+    view = memoryview(data)
+    frames = []
+    offset = 0
+    while offset + 12 <= len(data) and data[offset:offset + 4] == b"RIFF":
+        size = int.from_bytes(data[offset + 4:offset + 8], "little")
+        end = offset + 8 + size + (size & 1)
+        if end > len(data) or data[offset + 8:offset + 12] != b"WEBP":
+            break
+        frames.append(view[offset:end])
+        offset = end
+    return frames
 
 
 def get_video_duration(video_path: str) -> float:
-    """Uses FFmpeg to get video duration in seconds."""
-    import re
+    """
+    Returns video duration in seconds.
+    
+    MP4/MOV/M4V store the duration in the `mvhd` atom, which is read directly
+    from the file — no subprocess. Anything else (WebM, AVI, MKV) or a file
+    the atom reader can't parse falls back to asking FFmpeg.
+    """
+    try:
+        duration = _read_mvhd_duration(video_path)
+        if duration:
+            return duration
+    except Exception:
+        pass
+    return _ffmpeg_video_duration(video_path)
+
+
+def _iter_atoms(f, end: Optional[int] = None) -> Iterator[tuple[bytes, int, int]]:
+    """
+    Walks ISO base media atoms from the current file position.
+    Yields (type, payload_offset, payload_size) for each atom up to `end`.
+    """
+    while end is None or f.tell() < end:
+        start = f.tell()
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, atom_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            # 64-bit extended size follows the type
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # Atom runs to end of file
+            f.seek(0, os.SEEK_END)
+            size = f.tell() - start
+        if size < header_size:
+            raise ValueError(f"Corrupt atom {atom_type!r} at offset {start}")
+        yield atom_type, start + header_size, size - header_size
+        f.seek(start + size)
+
+
+def _read_mvhd_duration(video_path: str) -> Optional[float]:
+    """
+    Reads duration from the moov → mvhd atom of an MP4/MOV file.
+    Returns None if the file isn't an ISO base media file or has no mvhd.
+    """
+    with open(video_path, "rb") as f:
+        return _mvhd_duration(f)
+
+
+def _mvhd_duration(f: BinaryIO) -> Optional[float]:
+    """Finds moov → mvhd in a seekable binary file and returns its duration."""
+    for atom_type, offset, size in _iter_atoms(f):
+        if atom_type != b"moov":
+            continue
+        for child_type, child_offset, _ in _iter_atoms(f, end=offset + size):
+            if child_type != b"mvhd":
+                continue
+            version = f.read(4)[0]
+            if version == 1:
+                # creation(u64) modification(u64) timescale(u32) duration(u64)
+                _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+            else:
+                # creation(u32) modification(u32) timescale(u32) duration(u32)
+                _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+            if not timescale:
+                return None
+            return duration / timescale
+        return None
+    return None
+
+
+def _ffmpeg_video_duration(video_path: str) -> float:
+    """
+    Uses FFmpeg to get video duration in seconds.
+    With no output given, FFmpeg only opens the input, prints its header
+    (including the Duration line) and exits — nothing is decoded.
+    """
     cmd = [
         "ffmpeg",
-        "-i", video_path,
-        "-f", "null",
-        "-"
+        "-hide_banner",
+        "-i", video_path
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError("FFmpeg timed out while reading video duration")
     match = re.search(r'Duration: (\d+):(\d+):(\d+\.\d+)', result.stderr)
     if not match:
         raise RuntimeError("Could not determine video duration")
@@ -127,41 +462,68 @@ def get_video_duration(video_path: str) -> float:
 # CLAUDE API CALL
 # ─────────────────────────────────────────────────────────
 
-def analyze_frames_with_claude(
-    frames_b64: list[str],
+# One client per API key, reused across requests so the underlying HTTP
+# connection pool (and its TLS sessions) stays warm
+_CLIENTS: dict[Optional[str], anthropic.Anthropic] = {}
+
+# System prompt, marked cacheable — repeat calls within the cache TTL bill it
+# at the cache-read rate and skip its prefill, once the cached prefix reaches
+# MIN_CACHEABLE_TOKENS
+_SYSTEM_BLOCKS = [
+    {
+        "type": "text",
+        "text": SYSTEM_PROMPT,
+        "cache_control": {"type": "ephemeral"}
+    }
+]
+
+
+def _get_client(api_key: Optional[str]) -> anthropic.Anthropic:
+    """Returns the cached Anthropic client for this key, creating it on first use."""
+    client = _CLIENTS.get(api_key)
+    if client is None:
+        client = _CLIENTS.setdefault(api_key, anthropic.Anthropic(api_key=api_key))
+    return client
+
+
+def stream_frames_with_claude(
+    frames_b64: Optional[list[str]] = None,
     stroke_type: str = "general",
     student_info: Optional[dict] = None,
-    api_key: Optional[str] = None
-) -> str:
+    api_key: Optional[str] = None,
+    frame_url_list: Optional[list[str]] = None
+) -> Iterator[str]:
     """
-    Sends extracted frames to Claude with the coaching system prompt.
-    Returns the full analysis as a formatted string.
+    Sends extracted frames to Claude with the coaching system prompt and
+    yields the analysis text incrementally as Claude generates it.
     
     Args:
-        frames_b64: List of base64-encoded JPEG frames
+        frames_b64: List of base64-encoded WebP frames
         stroke_type: One of: forehand, backhand_one_handed, backhand_two_handed, 
                      serve, volley, general
         student_info: Dict with optional keys: name, level, age, concerns
         api_key: Anthropic API key (falls back to ANTHROPIC_API_KEY env var)
+        frame_url_list: Frame image URLs — used instead of frames_b64 when given
     
-    Returns:
-        Formatted coaching analysis string
+    Yields:
+        Chunks of the coaching analysis text, in order
     """
-    client = anthropic.Anthropic(api_key=api_key or os.environ.get("ANTHROPIC_API_KEY"))
-
-    # Build the message content — images first, then the text prompt
-    content = []
+    # Build the message content — static stroke focus first so it sits in the
+    # cached prefix with the system prompt, then images, then the text prompt
+    content = [{
+        "type": "text",
+        "text": build_stroke_prompt(stroke_type),
+        "cache_control": {"type": "ephemeral"}
+    }]
 
     # Add each frame as an image block
-    for i, frame_b64 in enumerate(frames_b64):
-        content.append({
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": "image/jpeg",
-                "data": frame_b64
-            }
-        })
+    if frame_url_list:
+        image_blocks = [_image_block(url=url) for url in frame_url_list]
+    else:
+        image_blocks = [_image_block(frame_b64) for frame_b64 in frames_b64]
+
+    for i, image_block in enumerate(image_blocks):
+        content.append(image_block)
         # Add a small label so Claude can reference frame numbers
         content.append({
             "type": "text",
@@ -170,7 +532,7 @@ def analyze_frames_with_claude(
 
     # Add the analysis request
     user_prompt = build_user_prompt(
-        frames_count=len(frames_b64),
+        frames_count=len(image_blocks),
         stroke_type=stroke_type,
         student_info=student_info
     )
@@ -179,21 +541,129 @@ def analyze_frames_with_claude(
         "text": user_prompt
     })
 
-    print(f"Sending {len(frames_b64)} frames to Claude for analysis...")
+    print(f"Sending {len(image_blocks)} frames to Claude for analysis...")
+
+    yield from _stream_claude(content, MAX_TOKENS_PER_CLIP, api_key)
+
+
+def _image_block(frame_b64: Optional[str] = None, url: Optional[str] = None) -> dict:
+    """Wraps one frame — base64 data or a fetchable URL — as a Claude image content block."""
+    if url:
+        return {
+            "type": "image",
+            "source": {
+                "type": "url",
+                "url": url
+            }
+        }
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": FRAME_MEDIA_TYPE,
+            "data": frame_b64
+        }
+    }
+
+
+def _stream_claude(content: list[dict], max_tokens: int, api_key: Optional[str]) -> Iterator[str]:
+    """Sends one user message under the coaching system prompt and yields text chunks."""
+    client = _get_client(api_key or os.environ.get("ANTHROPIC_API_KEY"))
 
-    response = client.messages.create(
+    with client.messages.stream(
         model=CLAUDE_MODEL,
-        max_tokens=2048,
-        system=SYSTEM_PROMPT,
+        max_tokens=max_tokens,
+        system=_SYSTEM_BLOCKS,
         messages=[
             {
                 "role": "user",
                 "content": content
             }
         ]
-    )
+    ) as stream:
+        yield from stream.text_stream
+
 
-    return response.content[0].text
+def analyze_frames_with_claude(
+    frames_b64: Optional[list[str]] = None,
+    stroke_type: str = "general",
+    student_info: Optional[dict] = None,
+    api_key: Optional[str] = None,
+    frame_url_list: Optional[list[str]] = None
+) -> str:
+    """
+    Sends extracted frames to Claude with the coaching system prompt.
+    Returns the full analysis as a formatted string.
+    
+    Blocking wrapper around stream_frames_with_claude for callers that
+    need the whole analysis at once.
+    
+    Args:
+        frames_b64: List of base64-encoded WebP frames
+        stroke_type: One of: forehand, backhand_one_handed, backhand_two_handed, 
+                     serve, volley, general
+        student_info: Dict with optional keys: name, level, age, concerns
+        api_key: Anthropic API key (falls back to ANTHROPIC_API_KEY env var)
+        frame_url_list: Frame image URLs — used instead of frames_b64 when given
+    
+    Returns:
+        Formatted coaching analysis string
+    """
+    chunks = list(stream_frames_with_claude(
+        frames_b64=frames_b64,
+        stroke_type=stroke_type,
+        student_info=student_info,
+        api_key=api_key,
+        frame_url_list=frame_url_list
+    ))
+    return "".join(chunks)
+
+
+def analyze_clips_with_claude(
+    clips: list[tuple[list[str], str]],
+    student_info: Optional[dict] = None,
+    api_key: Optional[str] = None
+) -> str:
+    """
+    Sends several clips' frames to Claude in one request, so the system
+    prompt and request overhead are paid once for the whole batch.
+    Returns one combined analysis with a report per clip.
+    
+    Args:
+        clips: (frames_b64, stroke_type) per clip
+        student_info: Dict with optional keys: name, level, age, concerns
+        api_key: Anthropic API key (falls back to ANTHROPIC_API_KEY env var)
+    
+    Returns:
+        Formatted coaching analysis string, one section per clip
+    """
+    content = []
+
+    for clip_num, (frames_b64, stroke_type) in enumerate(clips, start=1):
+        # Section header plus this clip's stroke focus, then its frames
+        content.append({
+            "type": "text",
+            "text": build_clip_header(clip_num, stroke_type)
+        })
+        for i, frame_b64 in enumerate(frames_b64):
+            content.append(_image_block(frame_b64))
+            content.append({
+                "type": "text",
+                "text": f"[Clip {clip_num}, Frame {i + 1}]"
+            })
+
+    content.append({
+        "type": "text",
+        "text": build_multi_clip_prompt(
+            clips=[(stroke_type, len(frames_b64)) for frames_b64, stroke_type in clips],
+            student_info=student_info
+        )
+    })
+
+    total_frames = sum(len(frames_b64) for frames_b64, _ in clips)
+    print(f"Sending {total_frames} frames from {len(clips)} clips to Claude for analysis...")
+
+    return "".join(_stream_claude(content, MAX_TOKENS_PER_CLIP * len(clips), api_key))
 
 
 # ─────────────────────────────────────────────────────────
@@ -240,13 +710,113 @@ def analyze_tennis_video(
         print(result["analysis"])
     """
     try:
-        # Step 1: Extract frames
-        frames = extract_frames(video_path)
+        # Step 1: Extract frames — uploaded to FRAME_BUCKET when sending by URL
+        frames_b64 = frame_keys = frame_urls = None
+        if USE_FRAME_URLS:
+            frame_keys, frame_urls = extract_frame_urls(video_path)
+        else:
+            frames_b64 = extract_frames(video_path)
 
         # Step 2: Send to Claude
-        analysis = analyze_frames_with_claude(
-            frames_b64=frames,
+        try:
+            analysis = analyze_frames_with_claude(
+                frames_b64=frames_b64,
+                frame_url_list=frame_urls,
+                stroke_type=stroke_type,
+                student_info=student_info,
+                api_key=api_key
+            )
+        finally:
+            if frame_keys:
+                delete_frames(frame_keys)
+
+        return {
+            "success": True,
+            "analysis": analysis,
+            "frames_analyzed": len(frame_urls or frames_b64),
+            "stroke_type": stroke_type,
+            "student_name": student_info.get("name", "Student") if student_info else "Student",
+            "error": None
+        }
+
+    except FileNotFoundError as e:
+        return {"success": False, "error": f"Video file not found: {e}", "analysis": None}
+    except RuntimeError as e:
+        return {"success": False, "error": f"Processing error: {e}", "analysis": None}
+    except anthropic.APIError as e:
+        return {"success": False, "error": f"Claude API error: {e}", "analysis": None}
+    except Exception as e:
+        return {"success": False, "error": f"Unexpected error: {e}", "analysis": None}
+
+
+def run_analysis_job(
+    video_path: str,
+    stroke_type: str = "general",
+    student_info: Optional[dict] = None
+) -> dict:
+    """
+    Background queue entry point — what RQ workers run for /api/analyze.
+    
+    Analyzes a video saved to shared storage, then deletes it. The API key
+    comes from the worker's ANTHROPIC_API_KEY environment variable, so it
+    never has to be stored with the job.
+    
+    Returns:
+        Same dict as analyze_tennis_video
+    """
+    try:
+        return analyze_tennis_video(
+            video_path=video_path,
             stroke_type=stroke_type,
+            student_info=student_info
+        )
+    finally:
+        Path(video_path).unlink(missing_ok=True)
+
+
+def analyze_tennis_videos(
+    videos: list[dict],
+    student_info: Optional[dict] = None,
+    api_key: Optional[str] = None
+) -> dict:
+    """
+    Multi-clip pipeline: several videos from one student → one Claude call.
+    
+    Use this instead of calling analyze_tennis_video per clip when a student
+    submits more than one (e.g. forehand + backhand) — the system prompt
+    and per-request overhead are shared across the batch.
+    
+    Args:
+        videos: Up to MAX_CLIPS_PER_BATCH dicts, each with keys:
+            - video_path: Path to the video file
+            - stroke_type: Type of stroke in this clip (default "general")
+        student_info: Optional student context
+        api_key: Anthropic API key
+    
+    Returns:
+        Dict with the same keys as analyze_tennis_video, except
+        stroke_type is replaced by:
+            - clips: List of {"stroke_type", "frames_analyzed"} per clip
+    """
+    if not videos:
+        return {"success": False, "error": "No videos provided", "analysis": None}
+    if len(videos) > MAX_CLIPS_PER_BATCH:
+        return {
+            "success": False,
+            "error": f"Too many clips: {len(videos)} (max {MAX_CLIPS_PER_BATCH})",
+            "analysis": None
+        }
+
+    try:
+        # Step 1: Extract frames from every clip
+        clips = []
+        for video in videos:
+            frames = extract_frames(video["video_path"])
+            clips.append((frames, video.get("stroke_type", "general")))
+
+        # Step 2: Send all clips to Claude together
+        analysis = analyze_clips_with_claude(
+            clips=clips,
             student_info=student_info,
             api_key=api_key
         )
@@ -254,8 +824,11 @@ def analyze_tennis_video(
         return {
             "success": True,
             "analysis": analysis,
-            "frames_analyzed": len(frames),
-            "stroke_type": stroke_type,
+            "frames_analyzed": sum(len(frames) for frames, _ in clips),
+            "clips": [
+                {"stroke_type": stroke_type, "frames_analyzed": len(frames)}
+                for frames, stroke_type in clips
+            ],
             "student_name": student_info.get("name", "Student") if student_info else "Student",
             "error": None
         }
@@ -274,31 +847,70 @@ def analyze_tennis_video(
 # COST ESTIMATOR — handy for business planning
 # ─────────────────────────────────────────────────────────
 
-def estimate_cost_per_analysis(num_frames: int = FRAMES_TO_EXTRACT) -> dict:
+def count_prefix_tokens(stroke_type: str = "general", api_key: Optional[str] = None) -> int:
+    """
+    Measures the cacheable prompt prefix — system prompt plus stroke focus
+    block — with the token counting endpoint, for CLAUDE_MODEL.
+    """
+    client = _get_client(api_key or os.environ.get("ANTHROPIC_API_KEY"))
+    result = client.messages.count_tokens(
+        model=CLAUDE_MODEL,
+        system=_SYSTEM_BLOCKS,
+        messages=[
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": build_stroke_prompt(stroke_type)}]
+            }
+        ]
+    )
+    return result.input_tokens
+
+
+def estimate_cost_per_analysis(
+    num_frames: int = FRAMES_TO_EXTRACT,
+    prompt_cached: bool = False,
+    prefix_tokens: Optional[int] = None,
+    api_key: Optional[str] = None
+) -> dict:
     """
     Rough cost estimate per student submission.
     Based on Anthropic's current pricing for Claude Opus.
     
-    Images are ~1,600 tokens each at standard resolution.
-    System prompt ~800 tokens. Response ~500 tokens.
+    Images are ~450 tokens each once downscaled to a 768px long edge.
+    Response ~500 tokens. The system prompt + stroke focus prefix is
+    measured with count_prefix_tokens unless prefix_tokens is given.
+    With prompt_cached (the steady state once traffic keeps the cache warm),
+    the prefix is billed at 10% of the input rate — but only if it is long
+    enough to be cached at all (MIN_CACHEABLE_TOKENS).
     """
+    if prefix_tokens is None:
+        prefix_tokens = count_prefix_tokens(api_key=api_key)
+
     # Approximate token counts
-    image_tokens = num_frames * 1600
-    system_tokens = 800
+    image_tokens = num_frames * 450
+    system_tokens = prefix_tokens
     response_tokens = 500
     total_input_tokens = image_tokens + system_tokens
     
     # Opus pricing (as of early 2026)
     input_cost_per_million = 15.00   # $15 per 1M input tokens
     output_cost_per_million = 75.00  # $75 per 1M output tokens
+    cache_read_multiplier = 0.1      # cache hits cost 10% of base input
+    
+    cache_applies = prompt_cached and system_tokens >= MIN_CACHEABLE_TOKENS
+    billed_system_tokens = system_tokens * cache_read_multiplier if cache_applies else system_tokens
+    billed_input_tokens = image_tokens + billed_system_tokens
     
-    input_cost = (total_input_tokens / 1_000_000) * input_cost_per_million
+    input_cost = (billed_input_tokens / 1_000_000) * input_cost_per_million
     output_cost = (response_tokens / 1_000_000) * output_cost_per_million
     total_cost = input_cost + output_cost
     
     return {
         "estimated_input_tokens": total_input_tokens,
         "estimated_output_tokens": response_tokens,
+        "prefix_tokens": prefix_tokens,
+        "prefix_cacheable": prefix_tokens >= MIN_CACHEABLE_TOKENS,
+        "prompt_cached": cache_applies,
         "estimated_cost_usd": round(total_cost, 4),
         "cost_at_25_per_session": f"${25 - total_cost:.2f} gross margin per submission"
     }
@@ -3,9 +3,18 @@ SD Tennis Lessons — Web Server
 Connects the student upload portal to the Claude analysis pipeline.
 
 Setup:
-    pip install flask anthropic opencv-python-headless Pillow
+    pip install -r requirements.txt
     export ANTHROPIC_API_KEY=your_key_here
-    python app.py
+    python app.py                      # local dev (single gevent server)
+
+Production (gevent workers — each Claude call is a yielding green thread,
+so one worker handles many in-flight analyses instead of one at a time):
+    gunicorn -k gevent -w 2 --worker-connections 1000 --timeout 120 -b 0.0.0.0:5000 app:app
+
+Background queue (optional — /api/analyze returns a job id to poll):
+    export REDIS_URL=redis://localhost:6379/0
+    export UPLOAD_FOLDER=/shared/tennis_uploads   # visible to web + workers
+    rq worker analysis --url $REDIS_URL
 
 Deploy options:
     - Railway.app (easiest, ~$5/month, handles video storage)
@@ -16,16 +25,60 @@ Deploy options:
 For production, swap local file storage for S3/Cloudflare R2.
 """
 
+# Must run before anything imports socket/ssl/threading (anthropic, httpx)
+from gevent import monkey
+monkey.patch_all()
+
 import os
 import uuid
+import shutil
 import tempfile
-from flask_cors import CORS
+import orjson
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
+from flask_compress import Compress
+from flask_cors import CORS
+from flask import Flask, Request, Response, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
+from redis import Redis
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
 from werkzeug.utils import secure_filename
-from analysis_pipeline import analyze_tennis_video
+from analysis_pipeline import (
+    USE_FRAME_URLS, analyze_tennis_video, delete_frames, extract_frame_urls, extract_frames,
+    run_analysis_job, stream_frames_with_claude
+)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson — faster than the stdlib for every jsonify"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class UploadRequest(Request):
+    """
+    Spools every file upload to a named temp file in UPLOAD_FOLDER.
+    Werkzeug writes uploads to disk anyway while parsing the form; giving
+    that file a name (and the upload's extension) lets FFmpeg read it by
+    path, so the upload is written once and never copied.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = Path(secure_filename(filename or "")).suffix
+        return tempfile.NamedTemporaryFile("wb+", dir=UPLOAD_FOLDER, suffix=suffix)
+
+
+class TennisFlask(Flask):
+    json_provider_class = OrjsonProvider
+    request_class = UploadRequest
+
 
-app = Flask(__name__, static_folder="../frontend")
+app = TennisFlask(__name__, static_folder="../frontend")
 CORS(app)
 
 # ─────────────────────────────────────────
@@ -35,18 +88,56 @@ CORS(app)
 # Max upload size: 500MB (adjust based on your server)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
 
+# Response compression — analyses are a few KB of markdown and shrink ~70%,
+# which matters for coaches reviewing on mobile data.
+# Streams stay uncompressed so SSE chunks are flushed as Claude writes them.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 512
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'm4v', 'webm'}
-UPLOAD_FOLDER = Path(tempfile.gettempdir()) / "tennis_uploads"
-UPLOAD_FOLDER.mkdir(exist_ok=True)
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 
+# Background queue — set REDIS_URL to run analyses on RQ workers instead of
+# inside the HTTP request. Without it, /api/analyze runs inline (local dev).
+REDIS_URL = os.environ.get("REDIS_URL")
+analysis_queue = Queue("analysis", connection=Redis.from_url(REDIS_URL)) if REDIS_URL else None
+
+# Uploads are spooled here while a request parses them, and queued uploads
+# wait here for a worker — must be a volume shared with the workers when
+# they run on other hosts/containers
+UPLOAD_FOLDER = Path(os.environ.get("UPLOAD_FOLDER", Path(tempfile.gettempdir()) / "tennis_uploads"))
+UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+
+# Job limits: FFmpeg (≤60s) + Claude generation, and how long results stay pollable
+JOB_TIMEOUT = 300
+JOB_RESULT_TTL = 3600
+
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def spooled_path(video_file) -> str:
+    """Path of the temp file UploadRequest spooled this upload into"""
+    video_file.stream.flush()
+    return video_file.stream.name
+
+
+def wants_event_stream() -> bool:
+    """True if the client asked for the analysis as Server-Sent Events"""
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Formats one Server-Sent Event. Data is JSON so newlines survive."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
+
+
 # ─────────────────────────────────────────
 # ROUTES
 # ─────────────────────────────────────────
@@ -69,7 +160,15 @@ def analyze():
         - level (string)
         - concerns (string, optional)
     
-    Returns JSON with analysis text.
+    Returns JSON with analysis text. If the request sends
+    `Accept: text/event-stream`, the analysis is streamed instead as
+    Server-Sent Events while Claude generates it:
+        data: {"text": "..."}          (repeated, one per chunk)
+        event: done / event: error     (terminal event)
+    
+    When the background queue is enabled (REDIS_URL set), JSON requests
+    return 202 with {"job_id": ...} immediately; poll
+    GET /api/analyze/<job_id> for the result.
     """
 
     # Validate file upload
@@ -103,16 +202,20 @@ def analyze():
 
     stroke_type = request.form.get('stroke_type', 'general')
 
-    # Save video temporarily
-    filename = f"{uuid.uuid4().hex}_{secure_filename(video_file.filename)}"
-    video_path = UPLOAD_FOLDER / filename
+    filename = secure_filename(video_file.filename)
 
-    try:
-        video_file.save(str(video_path))
+    # FFmpeg reads the upload straight from Werkzeug's spool file (see
+    # UploadRequest); it is deleted when the request closes
+    if wants_event_stream():
+        return stream_analysis(video_file, stroke_type, student_info)
 
+    if analysis_queue is not None:
+        return enqueue_analysis(video_file, filename, stroke_type, student_info)
+
+    try:
         # Run the analysis pipeline
         result = analyze_tennis_video(
-            video_path=str(video_path),
+            video_path=spooled_path(video_file),
             stroke_type=stroke_type,
             student_info=student_info if student_info else None,
             api_key=ANTHROPIC_API_KEY
@@ -132,10 +235,119 @@ def analyze():
             'error': f'Server error: {str(e)}'
         }), 500
 
-    finally:
-        # Always clean up the uploaded file
+
+def enqueue_analysis(video_file, filename: str, stroke_type: str, student_info: dict):
+    """
+    Queued variant of /api/analyze. The spooled upload is hard-linked to a
+    permanent name in UPLOAD_FOLDER (no copy) so it outlives the request and
+    a worker can pick it up; the worker deletes it once the analysis is done.
+    """
+    video_path = UPLOAD_FOLDER / f"{uuid.uuid4().hex}_{filename}"
+
+    try:
+        try:
+            os.link(spooled_path(video_file), video_path)
+        except OSError:
+            # Some shared volumes (SMB, FUSE mounts) don't support hard links
+            shutil.copyfile(spooled_path(video_file), video_path)
+        # The API key is left out on purpose — workers read ANTHROPIC_API_KEY
+        # from their own environment so it never lands in Redis
+        job = analysis_queue.enqueue(
+            run_analysis_job,
+            video_path=str(video_path),
+            stroke_type=stroke_type,
+            student_info=student_info if student_info else None,
+            job_timeout=JOB_TIMEOUT,
+            result_ttl=JOB_RESULT_TTL,
+            failure_ttl=JOB_RESULT_TTL
+        )
+    except Exception as e:
+        print(f"EXCEPTION enqueueing /api/analyze: {e}")
         if video_path.exists():
             video_path.unlink()
+        return jsonify({'success': False, 'error': f'Server error: {str(e)}'}), 500
+
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.get_status()}), 202
+
+
+@app.route('/api/analyze/<job_id>')
+def analyze_status(job_id):
+    """
+    Poll a queued analysis.
+    Returns 202 with {"status": ...} while queued/running, then the same JSON
+    /api/analyze returns synchronously once the job has finished.
+    """
+    if analysis_queue is None:
+        return jsonify({'success': False, 'error': 'Background queue is not enabled'}), 404
+
+    try:
+        job = Job.fetch(job_id, connection=analysis_queue.connection)
+    except NoSuchJobError:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+
+    status = job.get_status()
+
+    if status == 'finished':
+        result = job.result
+        return jsonify({**result, 'job_id': job.id, 'status': status}), 200 if result['success'] else 500
+
+    if status in ('failed', 'stopped', 'canceled'):
+        return jsonify({
+            'success': False,
+            'job_id': job.id,
+            'status': status,
+            'error': 'Analysis job did not complete. Please try again.'
+        }), 500
+
+    return jsonify({'success': True, 'job_id': job.id, 'status': status}), 202
+
+
+def stream_analysis(video_file, stroke_type: str, student_info: dict):
+    """
+    Streaming variant of /api/analyze. Frames are extracted up front so
+    extraction errors still come back as JSON; only the Claude generation
+    is streamed.
+    """
+    frames_b64 = frame_keys = frame_urls = None
+    try:
+        if USE_FRAME_URLS:
+            frame_keys, frame_urls = extract_frame_urls(spooled_path(video_file))
+        else:
+            frames_b64 = extract_frames(spooled_path(video_file))
+    except (FileNotFoundError, RuntimeError) as e:
+        return jsonify({'success': False, 'error': f'Processing error: {e}'}), 500
+
+    def generate():
+        try:
+            for text in stream_frames_with_claude(
+                frames_b64=frames_b64,
+                frame_url_list=frame_urls,
+                stroke_type=stroke_type,
+                student_info=student_info if student_info else None,
+                api_key=ANTHROPIC_API_KEY
+            ):
+                yield sse_event({'text': text})
+        except Exception as e:
+            print(f"EXCEPTION in /api/analyze stream: {e}")
+            yield sse_event({'success': False, 'error': f'Claude API error: {e}'}, event='error')
+            return
+        finally:
+            # Claude has fetched the frames by now (or never will)
+            if frame_keys:
+                delete_frames(frame_keys)
+
+        yield sse_event({
+            'success': True,
+            'frames_analyzed': len(frame_urls or frames_b64),
+            'stroke_type': stroke_type,
+            'student_name': student_info.get('name', 'Student') if student_info else 'Student'
+        }, event='done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @app.route('/api/health')
@@ -144,6 +356,7 @@ def health():
     return jsonify({
         'status': 'ok',
         'api_key_set': bool(ANTHROPIC_API_KEY),
+        'queue_enabled': analysis_queue is not None,
         'upload_dir': str(UPLOAD_FOLDER)
     })
 
@@ -183,4 +396,5 @@ if __name__ == '__main__':
     print("🎾 SD Tennis Lessons Analysis Server starting...")
     print("   Visit http://localhost:5000 to open the portal\n")
 
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(('0.0.0.0', 5000), app).serve_forever()
@@ -164,6 +164,41 @@ mechanical issue or the one most central to the student's game.
 """
 }
 
+# Display titles and full stroke focus blocks, built once at import —
+# they depend only on stroke type, so nothing here is per-request work
+_STROKE_TITLES = {k: k.replace('_', ' ').title() for k in STROKE_CONTEXT}
+
+_STROKE_PROMPTS = {
+    k: f"""Stroke focus for this analysis: {_STROKE_TITLES[k]}
+{v}"""
+    for k, v in STROKE_CONTEXT.items()
+}
+
+
+def _build_student_context(student_info: dict = None) -> str:
+    """Formats the optional student profile block that opens a user prompt."""
+    if not student_info:
+        return ""
+
+    name = student_info.get("name", "the student")
+    level = student_info.get("level", "intermediate")
+    age = student_info.get("age", "")
+    concerns = student_info.get("concerns", "")
+
+    return f"""
+STUDENT PROFILE:
+- Name: {name}
+- Level: {level}
+{f'- Age: {age}' if age else ''}
+{f'- Student notes: {concerns}' if concerns else ''}
+
+"""
+
+
+def _stroke_title(stroke_type: str) -> str:
+    # Same fallback as build_stroke_prompt, so a prompt never names two stroke types
+    return _STROKE_TITLES.get(stroke_type, _STROKE_TITLES["general"])
+
 
 def build_user_prompt(frames_count: int, stroke_type: str = "general", 
                        student_info: dict = None) -> str:
@@ -178,34 +213,75 @@ def build_user_prompt(frames_count: int, stroke_type: str = "general",
     Returns:
         Formatted prompt string
     """
-    student_context = ""
-    if student_info:
-        name = student_info.get("name", "the student")
-        level = student_info.get("level", "intermediate")
-        age = student_info.get("age", "")
-        concerns = student_info.get("concerns", "")
-        
-        student_context = f"""
-STUDENT PROFILE:
-- Name: {name}
-- Level: {level}
-{f'- Age: {age}' if age else ''}
-{f'- Student notes: {concerns}' if concerns else ''}
-
-"""
-
-    stroke_addition = STROKE_CONTEXT.get(stroke_type, STROKE_CONTEXT["general"])
+    student_context = _build_student_context(student_info)
 
     return f"""{student_context}I'm sending you {frames_count} frames extracted from a tennis video.
 Please analyze the stroke mechanics shown across these frames.
 
-Stroke type: {stroke_type.replace('_', ' ').title()}
-
-{stroke_addition}
+Stroke type: {_stroke_title(stroke_type)}
 
 Provide your full structured analysis following the format in your instructions."""
 
 
+def build_stroke_prompt(stroke_type: str = "general") -> str:
+    """
+    Returns the static stroke-specific focus block for a stroke type.
+
+    Kept separate from build_user_prompt so it can be sent as its own
+    content block and cached alongside the system prompt — it only
+    varies by stroke type, never by student.
+
+    Args:
+        stroke_type: Type of stroke being analyzed
+
+    Returns:
+        Stroke focus prompt string (unknown types fall back to "general")
+    """
+    return _STROKE_PROMPTS.get(stroke_type, _STROKE_PROMPTS["general"])
+
+
+def build_clip_header(clip_num: int, stroke_type: str) -> str:
+    """
+    Builds the "[Clip N: Stroke Type]" header and stroke focus for one clip.
+
+    Args:
+        clip_num: 1-based position of the clip in the batch
+        stroke_type: Type of stroke in the clip
+
+    Returns:
+        Header text to send ahead of the clip's frames
+    """
+    return f"[Clip {clip_num}: {_stroke_title(stroke_type)}]\n{build_stroke_prompt(stroke_type)}"
+
+
+def build_multi_clip_prompt(clips: list[tuple[str, int]], student_info: dict = None) -> str:
+    """
+    Builds the closing prompt for a batch of clips sent in one request.
+    
+    Args:
+        clips: (stroke_type, frames_count) per clip, in the order sent
+        student_info: Optional dict with name, level, age, specific_concerns
+    
+    Returns:
+        Formatted prompt string asking for one report per clip
+    """
+    student_context = _build_student_context(student_info)
+    clip_lines = "\n".join(
+        f"- Clip {i + 1}: {_stroke_title(stroke_type)} ({frames_count} frames)"
+        for i, (stroke_type, frames_count) in enumerate(clips)
+    )
+
+    return f"""{student_context}I'm sending you {len(clips)} clips from the same student, each introduced
+by a [Clip N: Stroke Type] header and its own stroke focus:
+{clip_lines}
+
+Analyze each clip separately. Write one full structured analysis per clip,
+in clip order, following the format in your instructions. Title each one
+"## 🎾 Stroke Analysis — Clip N: [Stroke Type]" and cite frames as
+"Clip N, Frame M". Where the same habit shows up across clips, say so
+in the Coach's Note of the last clip."""
+
+
 if __name__ == "__main__":
     # Quick test of prompt construction
     prompt = build_user_prompt(
@@ -220,5 +296,7 @@ if __name__ == "__main__":
     )
     print("=== SYSTEM PROMPT PREVIEW ===")
     print(SYSTEM_PROMPT[:500] + "...\n")
+    print("=== STROKE PROMPT ===")
+    print(build_stroke_prompt("forehand"))
     print("=== USER PROMPT ===")
     print(prompt)
@@ -0,0 +1,148 @@
+"""
+Tests for the binary parsers in analysis_pipeline — the mvhd duration
+reader, the container sniffer and the piped WebP frame splitter.
+
+These run without FFmpeg or an API key:
+    python -m unittest test_analysis_pipeline
+"""
+
+import io
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+from analysis_pipeline import _mvhd_duration, _read_mvhd_duration, _sniff_container, _split_webp_stream
+
+
+def atom(atom_type: bytes, payload: bytes = b"", extended: bool = False) -> bytes:
+    """Builds an ISO base media atom, optionally with a 64-bit size."""
+    if extended:
+        return struct.pack(">I4sQ", 1, atom_type, 16 + len(payload)) + payload
+    return struct.pack(">I4s", 8 + len(payload), atom_type) + payload
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    """Builds an mvhd atom; the fields after duration are zero-filled."""
+    if version == 1:
+        fields = struct.pack(">B3xQQIQ", 1, 0, 0, timescale, duration)
+    else:
+        fields = struct.pack(">B3xIIII", 0, 0, 0, timescale, duration)
+    return atom(b"mvhd", fields + bytes(80))
+
+
+FTYP = atom(b"ftyp", b"isom\x00\x00\x02\x00isomiso2mp41")
+
+
+def webp(payload: bytes) -> bytes:
+    """Builds a RIFF/WebP frame around `payload`, padded to an even length."""
+    body = b"WEBP" + payload
+    return b"RIFF" + struct.pack("<I", len(body)) + body + b"\x00" * (len(body) & 1)
+
+
+class MvhdDurationTest(unittest.TestCase):
+
+    def test_version_0(self):
+        data = FTYP + atom(b"moov", mvhd(1000, 12_345))
+        self.assertEqual(_mvhd_duration(io.BytesIO(data)), 12.345)
+
+    def test_version_1(self):
+        # 64-bit duration — 3 hours at a 90kHz timescale overflows a u32
+        data = FTYP + atom(b"moov", mvhd(90_000, 3 * 3600 * 90_000, version=1))
+        self.assertEqual(_mvhd_duration(io.BytesIO(data)), 3 * 3600)
+
+    def test_moov_after_mdat(self):
+        # Phone recordings without fast-start write the index last
+        data = FTYP + atom(b"mdat", bytes(4096)) + atom(b"moov", mvhd(600, 3000))
+        self.assertEqual(_mvhd_duration(io.BytesIO(data)), 5.0)
+
+    def test_extended_size_atoms(self):
+        data = (
+            FTYP
+            + atom(b"mdat", bytes(4096), extended=True)
+            + atom(b"moov", atom(b"udta", bytes(16)) + mvhd(1000, 2500), extended=True)
+        )
+        self.assertEqual(_mvhd_duration(io.BytesIO(data)), 2.5)
+
+    def test_size_zero_atom_runs_to_end_of_file(self):
+        data = FTYP + atom(b"moov", mvhd(1000, 4000)) + struct.pack(">I4s", 0, b"mdat") + bytes(64)
+        self.assertEqual(_mvhd_duration(io.BytesIO(data)), 4.0)
+
+    def test_missing_moov(self):
+        data = FTYP + atom(b"mdat", bytes(64))
+        self.assertIsNone(_mvhd_duration(io.BytesIO(data)))
+
+    def test_zero_timescale(self):
+        data = FTYP + atom(b"moov", mvhd(0, 1000))
+        self.assertIsNone(_mvhd_duration(io.BytesIO(data)))
+
+    def test_corrupt_atom_size(self):
+        data = FTYP + struct.pack(">I4s", 4, b"moov")
+        with self.assertRaises(ValueError):
+            _mvhd_duration(io.BytesIO(data))
+
+    def test_reads_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "clip.mov"
+            path.write_bytes(FTYP + atom(b"mdat", bytes(256)) + atom(b"moov", mvhd(600, 1800)))
+            self.assertEqual(_read_mvhd_duration(str(path)), 3.0)
+
+
+class SniffContainerTest(unittest.TestCase):
+
+    MP4_HEADER = FTYP[:32]
+    AVI_HEADER = b"RIFF\x00\x10\x00\x00AVI LIST" + bytes(16)
+    MKV_HEADER = b"\x1aE\xdf\xa3" + bytes(28)
+
+    def test_families(self):
+        self.assertEqual(_sniff_container(self.MP4_HEADER, "clip.mp4"), "iso")
+        self.assertEqual(_sniff_container(self.MP4_HEADER, "IMG_0001.MOV"), "iso")
+        self.assertEqual(_sniff_container(self.AVI_HEADER, "clip.avi"), "avi")
+        self.assertEqual(_sniff_container(self.MKV_HEADER, "clip.webm"), "matroska")
+
+    def test_extension_mismatch(self):
+        with self.assertRaisesRegex(RuntimeError, r"\.mkv file contains iso data"):
+            _sniff_container(self.MP4_HEADER, "clip.mkv")
+        with self.assertRaisesRegex(RuntimeError, r"\.mp4 file contains matroska data"):
+            _sniff_container(self.MKV_HEADER, "clip.mp4")
+
+    def test_unknown_extension_is_not_checked(self):
+        self.assertEqual(_sniff_container(self.MP4_HEADER, "upload"), "iso")
+
+    def test_unsupported_container(self):
+        with self.assertRaisesRegex(RuntimeError, "Unsupported container"):
+            _sniff_container(b"GIF89a" + bytes(26), "clip.mp4")
+        with self.assertRaisesRegex(RuntimeError, "Unsupported container"):
+            _sniff_container(b"", "clip.mp4")
+
+
+class SplitWebpStreamTest(unittest.TestCase):
+
+    def test_splits_frames(self):
+        frames = [webp(b"VP8 " + bytes(n)) for n in (10, 11, 300)]
+        split = _split_webp_stream(b"".join(frames))
+        self.assertEqual([bytes(frame) for frame in split], frames)
+
+    def test_frames_are_views(self):
+        data = webp(b"VP8 " + bytes(10)) * 2
+        self.assertTrue(all(isinstance(frame, memoryview) for frame in _split_webp_stream(data)))
+
+    def test_truncated_last_frame_is_dropped(self):
+        whole = webp(b"VP8 " + bytes(40))
+        data = whole + whole[:-5]
+        self.assertEqual([bytes(frame) for frame in _split_webp_stream(data)], [whole])
+
+    def test_truncated_header(self):
+        whole = webp(b"VP8 " + bytes(40))
+        self.assertEqual(len(_split_webp_stream(whole + b"RIFF\x20")), 1)
+        self.assertEqual(_split_webp_stream(b"RIFF"), [])
+
+    def test_stops_at_non_webp_data(self):
+        whole = webp(b"VP8 " + bytes(8))
+        avi = b"RIFF" + struct.pack("<I", 8) + b"AVI " + bytes(4)
+        self.assertEqual(len(_split_webp_stream(whole + avi + whole)), 1)
+        self.assertEqual(_split_webp_stream(b"\xff\xd8\xff" + whole), [])
+
+
+if __name__ == "__main__":
+    unittest.main()